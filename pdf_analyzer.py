@@ -1,87 +1,355 @@
-from google import genai
-from google.genai import types
-import fitz  # PyMuPDF
 import os
+import sys
 import argparse
 from pathlib import Path
-from PIL import Image
 from dotenv import load_dotenv
 import io
+import json
+import random
+import re
+import hashlib
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 
-from pdf_report import beautify_report
-from prompts import get_initial_analysis_prompt, get_detailed_analysis_prompt
+try:
+    import xxhash
+except ImportError:  # Optional: faster cache keys, falls back to hashlib.blake2b
+    xxhash = None
 
 # --- Configuration ---
 load_dotenv()
 API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in .env file or environment variables.")
-
-# Initialize the client
-client = genai.Client(api_key=API_KEY)
 MODEL_NAME = "gemini-2.5-flash-preview-04-17"
 
 # Use gemini-pro if you ONLY ever plan to send text
 # TEXT_MODEL_NAME = "gemini-pro"
 
+CACHE_DIR = Path("output") / ".cache"
+MANIFEST_NAME = "manifest.json"
+RESPONSE_CACHE_DIR = CACHE_DIR / "responses"
+
+# Screenshot encodings: format name -> (file suffix, MIME type)
+IMAGE_FORMATS = {
+    "png": (".png", "image/png"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+IMAGE_QUALITY = 85  # JPEG/WebP quality
+DEFAULT_DPI = 110
+MAX_IMAGE_SIDE = 1568  # Larger images are downsampled by Gemini anyway
+
 # --- Core Functions ---
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extracts all text content from a PDF file."""
-    full_text = ""
+@lru_cache(maxsize=None)
+def get_client():
+    """Returns the shared Gemini client, importing google.genai on first use."""
+    from google import genai
+    if not API_KEY:
+        raise ValueError("GOOGLE_API_KEY not found in .env file or environment variables.")
+    return genai.Client(api_key=API_KEY)
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hashes a file in fixed-size chunks with a fast non-cryptographic hash and returns the hex digest."""
+    h = xxhash.xxh3_128() if xxhash else hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+def default_workers() -> int:
+    """Default size of the page-processing pool."""
+    return min(os.cpu_count() or 1, 8)
+
+def positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+def _progress(iterable, total: int, desc: str):
+    """Wraps a per-page iterable in a progress bar, shown only on an interactive terminal."""
+    from tqdm import tqdm
+    return tqdm(iterable, total=total, desc=desc, unit="page", disable=not sys.stderr.isatty())
+
+def render_page(page, dpi: int = DEFAULT_DPI):
+    """Renders a page at the given DPI, scaled down so its long side is at most MAX_IMAGE_SIDE pixels."""
+    import fitz  # PyMuPDF
+    scale = dpi / 72
+    long_side = max(page.rect.width, page.rect.height) * scale
+    if long_side > MAX_IMAGE_SIDE:
+        scale *= MAX_IMAGE_SIDE / long_side
+    return page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+
+class PdfSession:
+    """Opens a PDF once so text extraction and screenshots can share the parsed document.
+
+    Worker processes still open the file themselves (fitz documents can't be shared across
+    processes); the session serves the page count and the single-worker paths.
+    """
+
+    def __init__(self, pdf_path: str):
+        self.pdf_path = str(pdf_path)
+        self.doc = None
+
+    def __enter__(self) -> "PdfSession":
+        import fitz  # PyMuPDF
+        self.doc = fitz.open(self.pdf_path)
+        if self.doc.needs_pass:
+            self.doc.close()
+            raise ValueError("document is encrypted")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.doc.close()
+
+    @property
+    def page_count(self) -> int:
+        return self.doc.page_count
+
+    def iter_text(self):
+        """Yields the text of each page."""
+        for page in self.doc.pages():
+            yield page.get_text("text")
+
+    def iter_pixmaps(self, dpi: int):
+        """Yields a rendered pixmap for each page."""
+        for page in self.doc.pages():
+            yield render_page(page, dpi)
+
+def _extract_page_text(pdf_path: str, page_index: int) -> str:
+    """Extracts the text of a single page. Opens the PDF itself so it can run in a worker process."""
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        return doc[page_index].get_text("text")
+
+def extract_text_from_pdf(session: PdfSession, workers: int = None, cache_path: str = None) -> str:
+    """Extracts all text content from a PDF file, processing pages in parallel.
+
+    If cache_path is given, the text is read from it when present and written to it otherwise.
+    """
+    if cache_path and Path(cache_path).is_file():
+        print(f"Using cached text from {cache_path}")
+        return Path(cache_path).read_text(encoding="utf-8")
+    workers = default_workers() if workers is None else workers
     try:
-        doc = fitz.open(pdf_path)
-        print(f"Extracting text from {doc.page_count} pages...")
-        for i, page in enumerate(doc.pages()):
-            text = page.get_text("text")
+        page_count = session.page_count
+        print(f"Extracting text from {page_count} pages...")
+        parts = [""] * page_count
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                texts = list(_progress(
+                    executor.map(_extract_page_text, repeat(session.pdf_path, page_count), range(page_count), chunksize=8),
+                    page_count, "Extracting text"
+                ))
+        else:
+            texts = _progress(session.iter_text(), page_count, "Extracting text")
+        for i, text in enumerate(texts):
             if text:
-                full_text += f"\n--- Page {i+1} ---\n{text}"
-        doc.close()
+                parts[i] = f"\n--- Page {i+1} ---\n{text}"
         print("Text extraction complete.")
-        return full_text.strip()
+        full_text = "".join(parts).strip()
+        if cache_path and full_text:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            Path(cache_path).write_text(full_text, encoding="utf-8")
+        return full_text
     except Exception as e:
-        print(f"Error extracting text from {pdf_path}: {e}")
+        print(f"Error extracting text from {session.pdf_path}: {e}")
         return ""
 
-def take_screenshots_of_pdf(pdf_path: str, output_folder: str, dpi: int = 150) -> list:
-    """Takes screenshots of each page of a PDF and saves them."""
-    image_paths = []
+def encode_pixmap(pix, img_format: str = "png") -> bytes:
+    """Encodes a rendered page as PNG, JPEG or WebP bytes."""
+    if img_format == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=IMAGE_QUALITY)
+    if img_format == "webp":
+        # PyMuPDF has no native WebP writer, so this one goes through Pillow
+        return pix.pil_tobytes(format="WEBP", quality=IMAGE_QUALITY)
+    return pix.tobytes("png")
+
+def _screenshot_path(output_folder: str, page_index: int, img_format: str = "png") -> Path:
+    suffix = IMAGE_FORMATS[img_format][0]
+    return Path(output_folder) / f"page_{page_index+1:03d}{suffix}"
+
+def _render_page(pdf_path: str, page_index: int, dpi: int, output_folder: str, img_format: str = "png") -> str:
+    """Renders a single page to an image file. Opens the PDF itself so it can run in a worker process."""
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        pix = render_page(doc[page_index], dpi)
+    img_path = _screenshot_path(output_folder, page_index, img_format)
+    img_path.write_bytes(encode_pixmap(pix, img_format))
+    return str(img_path)
+
+def _load_cached_screenshots(output_folder: str) -> list:
+    """Returns the screenshot paths listed in the folder's manifest, or [] if any are missing."""
+    manifest_path = Path(output_folder) / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return []
+    try:
+        pages = json.loads(manifest_path.read_text(encoding="utf-8"))["pages"]
+    except (ValueError, KeyError) as e:
+        print(f"Warning: Ignoring unreadable manifest {manifest_path}: {e}")
+        return []
+    image_paths = [str(Path(output_folder) / name) for name in pages]
+    if not all(Path(p).is_file() for p in image_paths):
+        return []
+    return image_paths
+
+def remove_screenshot_folder(output_folder: str) -> None:
+    """Removes the manifest and folder left once all screenshots in it have been deleted."""
+    try:
+        (Path(output_folder) / MANIFEST_NAME).unlink(missing_ok=True)
+        os.rmdir(output_folder)
+    except Exception as e:
+        print(f"Warning: Could not remove directory {output_folder}: {e}")
+
+def take_screenshots_of_pdf(session: PdfSession, output_folder: str, dpi: int = DEFAULT_DPI, workers: int = None, img_format: str = "png") -> list:
+    """Takes screenshots of each page of a PDF and saves them, rendering pages in parallel.
+
+    A manifest is written next to the screenshots; if a complete set is already present in
+    output_folder, it is reused without rendering.
+    """
+    image_paths = _load_cached_screenshots(output_folder)
+    if image_paths:
+        print(f"Using {len(image_paths)} cached screenshots from {output_folder}")
+        return image_paths
     Path(output_folder).mkdir(parents=True, exist_ok=True)
+    workers = default_workers() if workers is None else workers
     try:
-        doc = fitz.open(pdf_path)
-        print(f"Taking screenshots of {doc.page_count} pages (DPI: {dpi})...")
-        for i, page in enumerate(doc.pages()):
-            pix = page.get_pixmap(dpi=dpi)
-            img_path = Path(output_folder) / f"page_{i+1:03d}.png"
-            pix.save(str(img_path))
-            image_paths.append(str(img_path))
-            print(f"Saved screenshot: {img_path}")
-        doc.close()
-        print(f"Screenshots saved to {output_folder}")
+        page_count = session.page_count
+        print(f"Taking screenshots of {page_count} pages (DPI: {dpi}, format: {img_format}, workers: {workers})...")
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                image_paths = list(_progress(executor.map(
+                    _render_page,
+                    repeat(session.pdf_path, page_count),
+                    range(page_count),
+                    repeat(dpi, page_count),
+                    repeat(output_folder, page_count),
+                    repeat(img_format, page_count),
+                    chunksize=4
+                ), page_count, "Taking screenshots"))
+        else:
+            for i, pix in enumerate(_progress(session.iter_pixmaps(dpi), page_count, "Taking screenshots")):
+                img_path = _screenshot_path(output_folder, i, img_format)
+                img_path.write_bytes(encode_pixmap(pix, img_format))
+                image_paths.append(str(img_path))
+        manifest = {"dpi": dpi, "format": img_format, "pages": [Path(p).name for p in image_paths]}
+        (Path(output_folder) / MANIFEST_NAME).write_text(json.dumps(manifest), encoding="utf-8")
+        print(f"Saved {len(image_paths)} screenshots to {output_folder}")
         return image_paths
     except Exception as e:
-        print(f"Error taking screenshots from {pdf_path}: {e}")
+        print(f"Error taking screenshots from {session.pdf_path}: {e}")
         return []
 
-def prepare_gemini_input(prompt: str, text: str = None, image_paths: list = None, pdf_path: str = None) -> list:
-    """Prepares the input list for the Gemini API."""
+def _render_page_bytes(pdf_path: str, page_index: int, dpi: int, img_format: str = "png") -> bytes:
+    """Renders a single page to image bytes in memory. Opens the PDF itself so it can run in a worker process."""
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        return encode_pixmap(render_page(doc[page_index], dpi), img_format)
+
+def take_screenshots_of_pdf_to_bytes(session: PdfSession, dpi: int = DEFAULT_DPI, workers: int = None, img_format: str = "png") -> list:
+    """Renders each page of a PDF to image bytes without writing anything to disk."""
+    workers = default_workers() if workers is None else workers
+    try:
+        page_count = session.page_count
+        print(f"Rendering {page_count} pages in memory (DPI: {dpi}, format: {img_format}, workers: {workers})...")
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                image_blobs = list(_progress(executor.map(
+                    _render_page_bytes,
+                    repeat(session.pdf_path, page_count),
+                    range(page_count),
+                    repeat(dpi, page_count),
+                    repeat(img_format, page_count),
+                    chunksize=4
+                ), page_count, "Rendering pages"))
+        else:
+            image_blobs = [
+                encode_pixmap(pix, img_format)
+                for pix in _progress(session.iter_pixmaps(dpi), page_count, "Rendering pages")
+            ]
+        print(f"Rendered {len(image_blobs)} pages.")
+        return image_blobs
+    except Exception as e:
+        print(f"Error rendering pages from {session.pdf_path}: {e}")
+        return []
+
+def upload_file(file, mime_type: str):
+    """Uploads a path or file-like object through the Gemini Files API."""
+    from google.genai import types
+    return get_client().files.upload(file=file, config=types.UploadFileConfig(mime_type=mime_type))
+
+def upload_pdf(pdf_path: str):
+    """Uploads a PDF through the Gemini Files API so it is streamed instead of held in memory."""
+    try:
+        uploaded = upload_file(pdf_path, 'application/pdf')
+        print(f"Uploaded PDF file: {pdf_path} ({uploaded.name})")
+        return uploaded
+    except Exception as e:
+        print(f"Warning: Could not upload PDF file {pdf_path}: {e}")
+        return None
+
+def delete_uploaded_file(uploaded_file) -> None:
+    """Deletes a file previously uploaded through the Gemini Files API."""
+    try:
+        get_client().files.delete(name=uploaded_file.name)
+        print(f"Deleted uploaded file: {uploaded_file.name}")
+    except Exception as e:
+        print(f"Warning: Could not delete uploaded file {uploaded_file.name}: {e}")
+
+INLINE_REQUEST_LIMIT = 18 * 1024 * 1024  # Gemini rejects inline requests above ~20 MB
+
+def inline_payload_size(text: str = None, image_paths: list = None, image_blobs: list = None) -> int:
+    """Returns the number of bytes the document inputs would add to an inline request.
+
+    Inline images are base64-encoded in the request body, so each one counts 4/3 of its size.
+    """
+    size = len(text.encode("utf-8")) if text else 0
+    image_sizes = [os.path.getsize(p) for p in image_paths or []] + [len(b) for b in image_blobs or []]
+    size += sum(-(-n // 3) * 4 for n in image_sizes)
+    return size
+
+def build_context_parts(text: str = None, image_paths: list = None, pdf_file=None, image_blobs: list = None, image_mime_type: str = "image/png", delete_images: bool = False, request_count: int = 1) -> tuple:
+    """Builds the document parts of a Gemini request, reading every input once.
+
+    pdf_file is a file returned by upload_pdf; image_blobs are in-memory encoded pages, used
+    instead of image_paths when screenshots are not written to disk. With delete_images, each
+    screenshot file is removed as soon as its bytes are in the request. request_count is the
+    number of requests sent together in one payload (a batch job inlines the parts once per
+    prompt). If the inputs would exceed INLINE_REQUEST_LIMIT, the images are sent through the
+    Files API instead of inline.
+
+    Returns the parts, which can be shared by several prompts through with_prompt, and the
+    list of files uploaded for them (to be deleted with delete_uploaded_file).
+    """
+    from google.genai import types
     content_parts = []
+    uploaded_files = []
+
+    use_files = inline_payload_size(text, image_paths, image_blobs) * request_count > INLINE_REQUEST_LIMIT
+    if use_files:
+        print(f"Inputs exceed {INLINE_REQUEST_LIMIT // (1024 * 1024)} MiB, uploading images through the Files API...")
+
+    def image_part(source):
+        if not use_files:
+            data = source if isinstance(source, bytes) else Path(source).read_bytes()
+            return types.Part.from_bytes(data=data, mime_type=image_mime_type)
+        if isinstance(source, bytes):
+            with io.BytesIO(source) as buf:
+                uploaded = upload_file(buf, image_mime_type)
+        else:
+            uploaded = upload_file(source, image_mime_type)
+        uploaded_files.append(uploaded)
+        return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type)
     
-    # Add the prompt as the first part
-    content_parts.append(types.Part.from_text(text=prompt))
-    
-    if pdf_path:
-        try:
-            with open(pdf_path, 'rb') as f:
-                pdf_bytes = f.read()
-            content_parts.append(types.Part.from_bytes(
-                data=pdf_bytes,
-                mime_type='application/pdf'
-            ))
-            print(f"Added PDF file: {pdf_path}")
-        except Exception as e:
-            print(f"Warning: Could not load or add PDF file {pdf_path}: {e}")
+    if pdf_file:
+        content_parts.append(types.Part.from_uri(
+            file_uri=pdf_file.uri,
+            mime_type=pdf_file.mime_type
+        ))
+        print(f"Added uploaded PDF file: {pdf_file.name}")
     
     if text:
         content_parts.append(types.Part.from_text(text="\n\n--- PDF Text Content ---\n"))
@@ -92,72 +360,244 @@ def prepare_gemini_input(prompt: str, text: str = None, image_paths: list = None
         print(f"Loading {len(image_paths)} images for Gemini...")
         for img_path in image_paths:
             try:
-                with open(img_path, 'rb') as f:
-                    img_bytes = f.read()
-                content_parts.append(types.Part.from_bytes(
-                    data=img_bytes,
-                    mime_type='image/png'
-                ))
+                content_parts.append(image_part(img_path))
+                if delete_images:
+                    os.unlink(img_path)
                 print(f"Added image: {img_path}")
             except Exception as e:
                 print(f"Warning: Could not load or add image {img_path}: {e}")
         print("Image loading complete.")
 
-    # Create a single content with all parts
+    if image_blobs:
+        content_parts.append(types.Part.from_text(text="\n\n--- PDF Page Images ---\n"))
+        for i, img_bytes in enumerate(image_blobs):
+            try:
+                content_parts.append(image_part(img_bytes))
+            except Exception as e:
+                print(f"Warning: Could not add image for page {i+1}: {e}")
+        print(f"Added {len(image_blobs)} in-memory images.")
+
+    return content_parts, uploaded_files
+
+def with_prompt(prompt: str, context_parts: list) -> list:
+    """Prepares the input list for the Gemini API: the prompt followed by the shared context parts."""
+    from google.genai import types
+    # Create a single content with the prompt as the first part: the prompt is static, so
+    # keeping it ahead of the per-document parts gives a stable prefix for prompt caching
     content = types.Content(
         role='user',
-        parts=content_parts
+        parts=[types.Part.from_text(text=prompt), *context_parts]
     )
     
     return [content]
 
-def send_to_gemini(content_parts: list) -> str:
-    """Sends the prepared content to the Gemini API and returns the response."""
+def _generation_config(response_schema: dict = None):
+    """Generation settings shared by the interactive and batch paths.
+
+    With a response_schema, Gemini returns JSON matching it instead of free text.
+    """
+    from google.genai import types
+    if response_schema:
+        return types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(thinking_budget=4024),
+            response_mime_type="application/json",
+            response_schema=response_schema
+        )
+    return types.GenerateContentConfig(
+        thinking_config=types.ThinkingConfig(thinking_budget=4024)
+    )
+
+def print_usage_and_cost(response, price_factor: float = 1.0, label: str = None) -> None:
+    """Prints token usage and the estimated cost of a Gemini response.
+
+    The block is printed in a single call so concurrent requests don't interleave it.
+    """
+    if not getattr(response, 'usage_metadata', None):
+        return
+    input_tokens = response.usage_metadata.prompt_token_count
+    output_tokens = response.usage_metadata.candidates_token_count
+    total_tokens = input_tokens + output_tokens
+
+    # Calculate costs (per 1M tokens)
+    input_cost = (input_tokens / 1_000_000) * 0.15 * price_factor  # $0.15 per 1M input tokens
+    output_cost = (output_tokens / 1_000_000) * 3.50 * price_factor  # $3.50 per 1M output tokens
+    total_cost = input_cost + output_cost
+
+    title = f"API Usage and Cost Estimation ({label})" if label else "API Usage and Cost Estimation"
+    print("\n".join([
+        f"\n--- {title} ---",
+        f"Input tokens: {input_tokens:,}",
+        f"Output tokens: {output_tokens:,}",
+        f"Total tokens: {total_tokens:,}",
+        f"Estimated cost: ${total_cost:.6f}",
+        f"  - Input cost: ${input_cost:.6f}",
+        f"  - Output cost: ${output_cost:.6f}",
+        "------------------------------------",
+    ]))
+
+MAX_ATTEMPTS = 5
+MAX_BACKOFF = 30  # seconds
+
+def _is_retryable(error: Exception) -> bool:
+    """Server errors and rate limits are transient; other client errors are not."""
+    from google.genai import errors
+    if isinstance(error, errors.ServerError):
+        return True
+    return isinstance(error, errors.ClientError) and error.code == 429
+
+def _generate_with_retry(content_parts: list, response_schema: dict = None, label: str = "Gemini"):
+    """Calls generate_content, retrying transient failures with exponential backoff and jitter."""
+    client = get_client()
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return client.models.generate_content(
+                model=MODEL_NAME,
+                contents=content_parts,
+                config=_generation_config(response_schema)
+            )
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1 or not _is_retryable(e):
+                raise
+            delay = min(2 ** attempt, MAX_BACKOFF) + random.random()
+            print(f"[{label}] Gemini API call failed ({e}), retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+
+def send_to_gemini(content_parts: list, response_schema: dict = None, label: str = "Gemini") -> str:
+    """Sends the prepared content to the Gemini API and returns the response.
+
+    label names the analysis in the log lines, since several calls may run concurrently.
+    """
     try:
         start_time = time.time()
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=content_parts,
-            config=types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(thinking_budget=4024)
-            )
-        )
+        response = _generate_with_retry(content_parts, response_schema, label)
         end_time = time.time()
-        print(f"Gemini processing took {end_time - start_time:.2f} seconds.")
-
-        # Calculate token usage and cost
-        if hasattr(response, 'usage_metadata'):
-            input_tokens = response.usage_metadata.prompt_token_count
-            output_tokens = response.usage_metadata.candidates_token_count
-            total_tokens = input_tokens + output_tokens
-            
-            # Calculate costs (per 1M tokens)
-            input_cost = (input_tokens / 1_000_000) * 0.15  # $0.15 per 1M input tokens
-            output_cost = (output_tokens / 1_000_000) * 3.50  # $3.50 per 1M output tokens
-            total_cost = input_cost + output_cost
-            
-            print("\n--- API Usage and Cost Estimation ---")
-            print(f"Input tokens: {input_tokens:,}")
-            print(f"Output tokens: {output_tokens:,}")
-            print(f"Total tokens: {total_tokens:,}")
-            print(f"Estimated cost: ${total_cost:.6f}")
-            print(f"  - Input cost: ${input_cost:.6f}")
-            print(f"  - Output cost: ${output_cost:.6f}")
-            print("------------------------------------")
+        print(f"[{label}] Gemini processing took {end_time - start_time:.2f} seconds.")
+
+        print_usage_and_cost(response, label=label)
 
         return response.text
 
     except Exception as e:
-        print(f"An error occurred during Gemini API call: {e}")
+        print(f"[{label}] An error occurred during Gemini API call: {e}")
         return f"Error: Failed to get response from Gemini. {e}"
 
+BATCH_PRICE_FACTOR = 0.5  # Batch requests are billed at half the interactive rate
+BATCH_POLL_INTERVAL = 30  # seconds
+BATCH_MAX_WAIT = 24 * 60 * 60  # seconds; batch jobs target completion within 24 hours
+BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED",
+}
+BATCH_RESULT_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+
+def _cancel_batch_job(job_name: str) -> None:
+    """Cancels a batch job that is no longer being waited for."""
+    try:
+        get_client().batches.cancel(name=job_name)
+        print(f"Cancelled batch job {job_name}")
+    except Exception as e:
+        print(f"Warning: Could not cancel batch job {job_name}: {e}")
+
+def send_batch_to_gemini(contents_list: list, response_schema: dict = None) -> list:
+    """Submits several prepared contents as one inline batch job and returns the responses in order.
+
+    The job is cancelled if it is not done within BATCH_MAX_WAIT or the wait is interrupted.
+    """
+    from google.genai import types
+    client = get_client()
+    try:
+        start_time = time.time()
+        job = client.batches.create(
+            model=MODEL_NAME,
+            src=[
+                types.InlinedRequest(contents=contents, config=_generation_config(response_schema))
+                for contents in contents_list
+            ],
+            config=types.CreateBatchJobConfig(display_name="pdf-analyzer")
+        )
+        print(f"Submitted batch job {job.name}, waiting for results...")
+        try:
+            while job.state.name not in BATCH_DONE_STATES:
+                if time.time() - start_time > BATCH_MAX_WAIT:
+                    _cancel_batch_job(job.name)
+                    error = f"Error: Batch job {job.name} did not finish within {BATCH_MAX_WAIT} seconds."
+                    print(error)
+                    return [error] * len(contents_list)
+                time.sleep(BATCH_POLL_INTERVAL)
+                job = client.batches.get(name=job.name)
+                print(f"Batch job state: {job.state.name}")
+        except KeyboardInterrupt:
+            _cancel_batch_job(job.name)
+            raise
+        end_time = time.time()
+        print(f"Gemini batch processing took {end_time - start_time:.2f} seconds.")
+
+        if job.state.name not in BATCH_RESULT_STATES:
+            error = f"Error: Batch job {job.name} ended in state {job.state.name}. {job.error or ''}".strip()
+            print(error)
+            return [error] * len(contents_list)
+
+        results = []
+        inlined_responses = (job.dest.inlined_responses if job.dest else None) or []
+        for inline_response in inlined_responses[:len(contents_list)]:
+            if inline_response.error:
+                print(f"A batch request failed: {inline_response.error}")
+                results.append(f"Error: Failed to get response from Gemini. {inline_response.error}")
+                continue
+            print_usage_and_cost(inline_response.response, BATCH_PRICE_FACTOR)
+            results.append(inline_response.response.text)
+        if len(results) < len(contents_list):
+            print(f"Warning: Batch job {job.name} returned {len(results)} of {len(contents_list)} responses.")
+            results += ["Error: Failed to get response from Gemini. Missing from batch results."] * (len(contents_list) - len(results))
+        return results
+
+    except Exception as e:
+        print(f"An error occurred during Gemini batch API call: {e}")
+        return [f"Error: Failed to get response from Gemini. {e}"] * len(contents_list)
+
+def response_cache_key(prompt_id: str, *input_keys: str) -> str:
+    """Key for a Gemini response: the prompt, the model and whatever identifies the input."""
+    key = "|".join([prompt_id, MODEL_NAME, *input_keys])
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+def load_cached_response(key: str, suffix: str = ".md") -> str:
+    """Returns a previously cached Gemini response, or None."""
+    path = RESPONSE_CACHE_DIR / f"{key}{suffix}"
+    if not path.is_file():
+        return None
+    print(f"Using cached Gemini response from {path}")
+    return path.read_text(encoding="utf-8")
+
+def save_cached_response(key: str, response: str, suffix: str = ".md") -> None:
+    """Caches a Gemini response under a file suffix matching its format; failed calls are not cached."""
+    if response.startswith("Error:"):
+        return
+    RESPONSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    (RESPONSE_CACHE_DIR / f"{key}{suffix}").write_text(response, encoding="utf-8")
+
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+
+# Keys of a structured-output row -> report column names
+JSON_ROW_FIELDS = {"substance": "Substance Name", "range": "Concentration Range", "use_case": "Use Case"}
+
+def parse_json_rows(response: str) -> list:
+    """Parses a structured-output response into report rows; returns [] if it is not a JSON array."""
+    try:
+        items = json.loads(response)
+    except ValueError as e:
+        print(f"Warning: Could not parse JSON response: {e}")
+        return []
+    if not isinstance(items, list):
+        print("Warning: JSON response is not an array.")
+        return []
+    return [[str(item.get(key, "")) for key in JSON_ROW_FIELDS] for item in items if isinstance(item, dict)]
+
 def clean_table_response(response: str) -> str:
     """Cleans the response to ensure it's only a table."""
     # Extract the table and clean it
     table = response.strip()
     # Remove any empty lines
-    lines = [line for line in table.split('\n') if line.strip()]
-    return '\n'.join(lines)
+    return BLANK_LINES_RE.sub('\n', table)
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -172,18 +612,40 @@ if __name__ == "__main__":
     parser.add_argument(
         "--dpi",
         type=int,
-        default=150,
-        help="Resolution (DPI) for screenshots (default: 150)."
+        default=DEFAULT_DPI,
+        help=f"Resolution (DPI) for screenshots (default: {DEFAULT_DPI}); pages are capped at {MAX_IMAGE_SIDE}px on the long side."
+    )
+    parser.add_argument(
+        "--img-format",
+        choices=list(IMAGE_FORMATS),
+        default="jpeg",
+        help="Encoding for screenshots sent to Gemini (default: jpeg, quality 85)."
+    )
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=default_workers(),
+        help="Number of worker processes for page rendering and text extraction (default: min(CPU count, 8))."
     )
     parser.add_argument(
         "--skip_gemini",
         action="store_true",
         help="Only extract text/screenshots, do not send to Gemini."
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit both analyses through the Gemini Batch API (half price, non-interactive)."
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Ask Gemini for JSON rows matching a schema instead of Markdown tables."
+    )
     parser.add_argument(
         "--cleanup",
         action="store_true",
-        help="Delete screenshot files after sending to Gemini (use with caution)."
+        help="Keep screenshots in memory only instead of writing them to disk."
     )
 
     args = parser.parse_args()
@@ -199,26 +661,77 @@ if __name__ == "__main__":
     
     # Generate output filenames based on input file and mode
     base_name = pdf_path.stem
-    screenshots_dir = output_dir / f"{base_name}_screenshots"
-    text_output_path = output_dir / f"{base_name}_{args.mode}_analysis.md"
-    detailed_output_path = output_dir / f"{base_name}_{args.mode}_detailed_analysis.md"
+    # Screenshots and extracted text are cached by PDF content so repeat runs skip rendering
+    pdf_digest = file_digest(str(pdf_path))
+    screenshots_dir = CACHE_DIR / f"{pdf_digest}_{args.dpi}_{args.img_format}"
+    text_cache_path = CACHE_DIR / f"{pdf_digest}.txt"
+    # Only Gemini's structured output is JSON; --skip_gemini saves the extracted text
+    output_suffix = ".json" if args.json and not args.skip_gemini else ".md"
+    text_output_path = output_dir / f"{base_name}_{args.mode}_analysis{output_suffix}"
+    detailed_output_path = output_dir / f"{base_name}_{args.mode}_detailed_analysis{output_suffix}"
+
+    # --- Look Up Cached Responses ---
+    # The prompt and input fully determine the request, so repeat runs are served from disk
+    # before anything is extracted or rendered
+    responses = {}
+    pending = []
+    if not args.skip_gemini:
+        # Imported here so page worker processes (which re-import this module) and --skip_gemini
+        # runs never compose the prompt texts or hash their IDs
+        import prompts
+
+        response_schema = None
+        if args.json:
+            initial_prompt, response_schema = prompts.get_initial_analysis_prompt_json()
+            detailed_prompt, _ = prompts.get_detailed_analysis_prompt_json()
+            prompt_ids = {"initial": prompts.INITIAL_PROMPT_JSON_ID, "detailed": prompts.DETAILED_PROMPT_JSON_ID}
+        else:
+            initial_prompt = prompts.get_initial_analysis_prompt()
+            detailed_prompt = prompts.get_detailed_analysis_prompt()
+            prompt_ids = {"initial": prompts.INITIAL_PROMPT_ID, "detailed": prompts.DETAILED_PROMPT_ID}
+        prompt_texts = {"initial": initial_prompt, "detailed": detailed_prompt}
+
+        input_keys = [pdf_digest, args.mode]
+        if args.mode in ["screenshots", "both"]:
+            input_keys += [str(args.dpi), args.img_format]
+        cache_keys = {name: response_cache_key(prompt_ids[name], *input_keys) for name in prompt_texts}
+        responses = {name: load_cached_response(key, output_suffix) for name, key in cache_keys.items()}
+        pending = [name for name, response in responses.items() if response is None]
 
     # --- Step 1 & 2: Extract Text / Take Screenshots ---
     extracted_text = None
     screenshot_paths = []
+    screenshot_blobs = []
 
-    if args.mode in ["text", "both"]:
-        extracted_text = extract_text_from_pdf(str(pdf_path))
-        if not extracted_text:
-            print("Warning: No text could be extracted.")
+    # Nothing to extract when every response is already cached
+    needs_inputs = args.skip_gemini or bool(pending)
 
-    if args.mode in ["screenshots", "both"]:
-        screenshot_paths = take_screenshots_of_pdf(str(pdf_path), str(screenshots_dir), args.dpi)
-        if not screenshot_paths:
-            print("Warning: No screenshots could be generated.")
+    if args.mode != "direct" and needs_inputs:
+        # Open the PDF once for both text extraction and screenshots. The steps below handle
+        # their own errors, so anything caught here means the file could not be opened.
+        try:
+            with PdfSession(pdf_path) as session:
+                if args.mode in ["text", "both"]:
+                    extracted_text = extract_text_from_pdf(session, args.workers, str(text_cache_path))
+                    if not extracted_text:
+                        print("Warning: No text could be extracted.")
+
+                if args.mode in ["screenshots", "both"]:
+                    if args.cleanup and not args.skip_gemini:
+                        # Screenshots are only needed for the request: reuse files cached by an
+                        # earlier run (deleted as they are consumed), otherwise keep them in memory
+                        screenshot_paths = _load_cached_screenshots(str(screenshots_dir))
+                        if not screenshot_paths:
+                            screenshot_blobs = take_screenshots_of_pdf_to_bytes(session, args.dpi, args.workers, args.img_format)
+                    else:
+                        screenshot_paths = take_screenshots_of_pdf(session, str(screenshots_dir), args.dpi, args.workers, args.img_format)
+                    if not screenshot_paths and not screenshot_blobs:
+                        print("Warning: No screenshots could be generated.")
+        except Exception as e:
+            print(f"Error opening PDF {pdf_path}: {e}")
 
     # --- Check if any data was generated ---
-    if not extracted_text and not screenshot_paths and args.mode != "direct":
+    if needs_inputs and not extracted_text and not screenshot_paths and not screenshot_blobs and args.mode != "direct":
         print("Error: No text extracted and no screenshots generated. Cannot proceed.")
         exit(1)
 
@@ -232,15 +745,49 @@ if __name__ == "__main__":
         exit(0)
 
     # --- Step 3: Prepare Input and Send to Gemini ---
-    # First analysis
-    content_parts = prepare_gemini_input(
-        get_initial_analysis_prompt(), 
-        extracted_text if args.mode != "direct" else None, 
-        screenshot_paths if args.mode != "direct" else None,
-        str(pdf_path) if args.mode == "direct" else None
-    )
-    gemini_response = send_to_gemini(content_parts)
-    cleaned_response = clean_table_response(gemini_response)
+    if pending:
+        get_client()  # Fail early if the API key is missing
+        uploaded_pdf = upload_pdf(str(pdf_path)) if args.mode == "direct" else None
+        if args.mode == "direct" and not uploaded_pdf:
+            print("Error: PDF could not be uploaded. Cannot proceed.")
+            exit(1)
+
+        # Load the document once; both prompts share the same context parts
+        context_parts, uploaded_images = build_context_parts(
+            extracted_text,
+            screenshot_paths,
+            uploaded_pdf,
+            screenshot_blobs,
+            IMAGE_FORMATS[args.img_format][1],
+            delete_images=args.cleanup,
+            request_count=len(pending) if args.batch else 1
+        )
+        if args.cleanup and screenshot_paths:
+            remove_screenshot_folder(str(screenshots_dir))
+        # The analyses depend only on the extracted inputs, so send them concurrently
+        contents = [with_prompt(prompt_texts[name], context_parts) for name in pending]
+        if args.batch:
+            results = send_batch_to_gemini(contents, response_schema)
+        else:
+            with ThreadPoolExecutor(max_workers=len(contents)) as executor:
+                results = list(executor.map(send_to_gemini, contents, repeat(response_schema), pending))
+        for name, response in zip(pending, results):
+            responses[name] = response
+            save_cached_response(cache_keys[name], response, output_suffix)
+
+        for uploaded_file in [uploaded_pdf, *uploaded_images]:
+            if uploaded_file:
+                delete_uploaded_file(uploaded_file)
+
+    from pdf_report import beautify_report, beautify_report_rows
+
+    if args.json:
+        # Structured output is already row data, so it needs no table post-processing
+        cleaned_response = responses["initial"].strip()
+        cleaned_detailed_response = responses["detailed"].strip()
+    else:
+        cleaned_response = clean_table_response(responses["initial"])
+        cleaned_detailed_response = clean_table_response(responses["detailed"])
     
     # Save initial analysis
     with open(text_output_path, "w", encoding="utf-8") as f:
@@ -248,39 +795,22 @@ if __name__ == "__main__":
     print(f"Initial analysis results saved to {text_output_path}")
     
     # Generate initial PDF report
-    initial_report_path = beautify_report(cleaned_response, str(pdf_path))
+    if args.json:
+        initial_report_path = beautify_report_rows(list(JSON_ROW_FIELDS.values()), parse_json_rows(cleaned_response), str(pdf_path))
+    else:
+        initial_report_path = beautify_report(cleaned_response, str(pdf_path))
     print(f"Initial professional report generated: {initial_report_path}")
 
-    # Second analysis (detailed)
-    content_parts = prepare_gemini_input(
-        get_detailed_analysis_prompt(), 
-        extracted_text if args.mode != "direct" else None, 
-        screenshot_paths if args.mode != "direct" else None,
-        str(pdf_path) if args.mode == "direct" else None
-    )
-    detailed_response = send_to_gemini(content_parts)
-    cleaned_detailed_response = clean_table_response(detailed_response)
-    
     # Save detailed analysis
     with open(detailed_output_path, "w", encoding="utf-8") as f:
         f.write(cleaned_detailed_response)
     print(f"Detailed analysis results saved to {detailed_output_path}")
     
     # Generate detailed PDF report
-    detailed_report_path = beautify_report(cleaned_detailed_response, str(pdf_path))
+    if args.json:
+        detailed_report_path = beautify_report_rows(list(JSON_ROW_FIELDS.values()), parse_json_rows(cleaned_detailed_response), str(pdf_path), report_name="detailed_analysis")
+    else:
+        detailed_report_path = beautify_report(cleaned_detailed_response, str(pdf_path), report_name="detailed_analysis")
     print(f"Detailed professional report generated: {detailed_report_path}")
 
-    # Cleanup screenshots if requested
-    if args.cleanup and screenshot_paths:
-        print("Cleaning up screenshot files...")
-        for img_path in screenshot_paths:
-            try:
-                os.remove(img_path)
-            except Exception as e:
-                print(f"Warning: Could not delete {img_path}: {e}")
-        try:
-            os.rmdir(screenshots_dir)
-        except Exception as e:
-            print(f"Warning: Could not remove directory {screenshots_dir}: {e}")
-
     print("\nScript finished.") 
\ No newline at end of file
@@ -1,9 +1,38 @@
+import re
+from itertools import cycle
 from pathlib import Path
 from datetime import datetime
 from fpdf import FPDF
 from fpdf_table import PDFTable, Align
 
-def beautify_report(table_content: str, pdf_path: str, output_dir: str = "output") -> str:
+# Markdown table rows: the text between the first and last pipe of a line
+TABLE_ROW_RE = re.compile(r'^\s*\|(.*)\|\s*$', re.M)
+# The header separator row, such as |---|:---:|
+SEPARATOR_ROW_RE = re.compile(r'[\s|:-]+')
+# Cell boundaries, including the whitespace padding around them
+CELL_SPLIT_RE = re.compile(r'\s*\|\s*')
+
+# Alternating data row backgrounds: light beige, white
+ROW_FILL_COLORS = ((245, 245, 220), (255, 255, 255))
+
+def parse_markdown_table(table_content: str) -> tuple:
+    """
+    Parses a markdown table into its header and data rows.
+
+    Args:
+        table_content: The markdown table content
+
+    Returns:
+        Tuple of (headers, rows), where each row is a list of stripped cell strings
+    """
+    rows = TABLE_ROW_RE.findall(table_content)
+    if not rows:
+        return [], []
+    # Only the row right after the header is a separator; later rows made of dashes are data
+    body = rows[2:] if len(rows) > 1 and SEPARATOR_ROW_RE.fullmatch(rows[1]) else rows[1:]
+    return CELL_SPLIT_RE.split(rows[0].strip()), [CELL_SPLIT_RE.split(row.strip()) for row in body]
+
+def beautify_report(table_content: str, pdf_path: str, output_dir: str = "output", report_name: str = "analysis") -> str:
     """
     Creates a beautiful PDF report from the analysis results using fpdf_table.
     
@@ -11,6 +40,25 @@ def beautify_report(table_content: str, pdf_path: str, output_dir: str = "output
         table_content: The markdown table content from Gemini
         pdf_path: Path to the original PDF file
         output_dir: Directory to save the report
+        report_name: Name of the analysis, used in the report filename
+        
+    Returns:
+        Path to the generated report PDF
+    """
+    # Parse the markdown table
+    headers, data = parse_markdown_table(table_content)
+    return beautify_report_rows(headers, data, pdf_path, output_dir, report_name)
+
+def beautify_report_rows(headers: list, data: list, pdf_path: str, output_dir: str = "output", report_name: str = "analysis") -> str:
+    """
+    Creates the PDF report from already parsed analysis results.
+    
+    Args:
+        headers: The column names
+        data: The data rows, each a list of cell strings
+        pdf_path: Path to the original PDF file
+        output_dir: Directory to save the report
+        report_name: Name of the analysis, used in the report filename
         
     Returns:
         Path to the generated report PDF
@@ -22,18 +70,9 @@ def beautify_report(table_content: str, pdf_path: str, output_dir: str = "output
     # Generate report filename with original PDF name
     original_pdf_name = Path(pdf_path).stem
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_filename = f"{original_pdf_name}_analysis_report_{timestamp}.pdf"
+    report_filename = f"{original_pdf_name}_{report_name}_report_{timestamp}.pdf"
     report_path = report_dir / report_filename
     
-    # Parse the markdown table
-    lines = table_content.strip().split('\n')
-    headers = [h.strip() for h in lines[0].split('|')[1:-1]]
-    data = []
-    for line in lines[2:]:  # Skip header and separator lines
-        if line.strip():
-            row = [cell.strip() for cell in line.split('|')[1:-1]]
-            data.append(row)
-    
     # Initialize PDFTable
     pdf = PDFTable()
     pdf.add_page()
@@ -76,17 +115,12 @@ def beautify_report(table_content: str, pdf_path: str, output_dir: str = "output
     pdf.table_header(headers, col_widths, align=Align.L)
     
     # Set up data row styles
-    pdf.set_fill_color(245, 245, 220)  # Beige background for data
     pdf.set_text_color(0, 0, 0)  # Black text for data
     pdf.set_font("Helvetica", "", 9)
     
     # Add data rows with alternating background colors
-    for i, row in enumerate(data):
-        # Set background color for alternating rows
-        if i % 2 == 0:
-            pdf.set_fill_color(245, 245, 220)  # Light beige
-        else:
-            pdf.set_fill_color(255, 255, 255)  # White
+    for row, fill_color in zip(data, cycle(ROW_FILL_COLORS)):
+        pdf.set_fill_color(*fill_color)
         
         # Add row with responsive option
         pdf.table_row(
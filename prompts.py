@@ -1,41 +1,69 @@
-from typing import List
+import sys
+import hashlib
+from typing import Tuple
 
-def get_initial_analysis_prompt() -> str:
-    return """
-Analyze the provided content (text excerpts and/or page images from a PDF document, likely a scientific paper, patent, or technical sheet). Your goal is to identify chemical substances mentioned.
+def _module(module_id: str, text: str) -> str:
+    """Wraps a reusable prompt block in a fixed marker so servers can key cached states on it."""
+    return f'<module id="{module_id}">\n{text.strip()}\n</module>\n'
+
+# Reusable instruction blocks. They are concatenated in the same order for every prompt,
+# so the shared part forms one identical prefix.
+_MOD_IDENTIFY: str = _module("identify", """**Identify Chemical Substances:** Find chemical compounds, ingredients, or substances mentioned in the document.""")
+
+_MOD_SYNONYMS: str = _module("synonyms", """**Recognize Synonyms & Abbreviations:** Understand that the same substance might be referred to by different names (e.g., Sodium Chloride, NaCl, salt, saline solution) or abbreviations (e.g., H2O2 for Hydrogen Peroxide, EtOH for Ethanol). Group these under a primary or common standardized name where possible. If an abbreviation's meaning isn't explicitly defined but is clear from context (common chemical abbreviations), include it.""")
+
+_MOD_CONCENTRATION: str = _module("concentration", """**Extract Concentration/Range:** For each identified substance, search the text and any visible tables in the images for concentration information. Look for percentages (e.g., 5%, 0.1% w/w, 1-10% v/v), ranges (e.g., "between 0.5% and 2%", "up to 15%"), or descriptive terms (e.g., "trace amount", "major component"). Report the found range or value precisely as stated. If no concentration is found for a substance, state "Not specified".""")
+
+_MOD_USE_CASE: str = _module("use-case", """**Determine Use Case/Function:** Based on the context where the substance is mentioned, determine its described purpose or application. Examples include: 'active ingredient', 'preservative', 'emulsifier', 'solvent', 'pH adjuster', 'fragrance component', 'thickener', 'rinse-off product context', 'leave-on formulation context', 'catalyst', 'reactant', etc. If the context is unclear or no specific function is mentioned, state "Not specified". Look for mentions in formulation tables, experimental descriptions, or introductory/concluding remarks about components.""")
+
+_MOD_SOURCES: str = _module("sources", """**Where to Look:** Relevant information is often spread across the document: the introduction or scope section, tables of frequency and concentration of use, formulation examples, method sections, and the summary or conclusion. When page images are provided, tables visible in them count as much as running text.""")
+
+_MOD_REFERENCE_EXAMPLE: str = _module("reference-example", """Reference example used below. Suppose a document's introduction lists five ingredients and the document mentions:
+- Sodium Hyaluronate used as a moisturizer and active at 0.1-1.5% w/w
+- Phenoxyethanol used as a preservative at up to 1%
+- Glycerin used as a humectant at 2-5% and as a solvent at 10%
+- Citric Acid used as a pH adjuster, with no amount given
+- Titanium Dioxide (TiO2) used as a UV filter in sunscreens at 10%""")
+
+# Rules and reference example common to both analyses and both output formats. Every prompt
+# starts with it, so a session issuing several request types shares one cached prefix. Keep
+# each full prompt above Gemini's 1024-token minimum for prompt caching (~4 characters per token).
+_COMMON_HEADER: str = """
+Analyze the provided content (text excerpts and/or page images from a PDF document, likely a scientific paper, safety assessment report, patent, or technical sheet). Your goal is to identify the chemical substances the document is about, the concentrations at which they are used, and what they are used for.
 
-Follow these instructions carefully:
+These general guidelines apply to every analysis:
 
-1.  **Identify Chemical Substances:** Find chemical compounds, ingredients, or substances. Filter out not relevant one, for example try to find in the introduction of the report the substances that the specific report is focusing on, usually they are specified in the introduction as a list of substances. IMPORTANT: Do not include any substances that are not mentioned in the introduction of the report.
-2.  **Recognize Synonyms & Abbreviations:** Understand that the same substance might be referred to by different names (e.g., Sodium Chloride, NaCl, salt, saline solution) or abbreviations (e.g., H2O2 for Hydrogen Peroxide, EtOH for Ethanol). Group these under a primary or common standardized name where possible. If an abbreviation's meaning isn't explicitly defined but is clear from context (common chemical abbreviations), include it.
-3.  **Extract Concentration/Range:** For each identified substance, search the text and any visible tables in the images for concentration information. Look for percentages (e.g., 5%, 0.1% w/w, 1-10% v/v), ranges (e.g., "between 0.5% and 2%", "up to 15%"), or descriptive terms (e.g., "trace amount", "major component"). Report the found range or value precisely as stated. If no concentration is found for a substance, state "Not specified".
-4.  **Determine Use Case/Function:** Based on the context where the substance is mentioned, determine its described purpose or application. Examples include: 'active ingredient', 'preservative', 'emulsifier', 'solvent', 'pH adjuster', 'fragrance component', 'thickener', 'rinse-off product context', 'leave-on formulation context', 'catalyst', 'reactant', etc. If the context is unclear or no specific function is mentioned, state "Not specified". Look for mentions in formulation tables, experimental descriptions, or introductory/concluding remarks about components.
-5.  **Order by Importance:** List the substances in descending order of their apparent importance or prominence within the document. Consider factors like:
+""" + "".join([
+    _MOD_IDENTIFY,
+    _MOD_SYNONYMS,
+    _MOD_CONCENTRATION,
+    _MOD_USE_CASE,
+    _MOD_SOURCES,
+    _MOD_REFERENCE_EXAMPLE,
+])
+
+# Output format blocks, placed right after the common header. Each one describes how the
+# result rows of either task are written.
+_TABLE_FORMAT: str = _module("output-format", """**Output Format:** Present the results STRICTLY as a Markdown table with the following columns: `Substance Name` | `Concentration Range` | `Use Case`. Each result row described below is one table row. Do NOT include any introductory text before the table or concluding remarks after it. Just output the table.""")
+
+_JSON_FORMAT: str = _module("output-format", """**Output Format:** Return the results STRICTLY as a JSON array matching the provided schema, with one object per result row described below: `substance` holds the Substance Name, `range` the Concentration Range and `use_case` the Use Case, each as a plain string. Do NOT wrap the array in a code block and do NOT include any text before or after it. Just output the JSON array.""")
+
+_INITIAL_SPECIFIC: str = "\n" + _module("task-summary", """Task: create a summary table with one row per substance. Follow these instructions carefully:
+
+1.  **Focus on the Report's Substances:** Filter out not relevant ones, for example try to find in the introduction of the report the substances that the specific report is focusing on, usually they are specified in the introduction as a list of substances. IMPORTANT: Do not include any substances that are not mentioned in the introduction of the report.
+2.  **Exclusions:** Generally exclude very common, non-functional substances like 'water' or 'air' unless they are specifically discussed in a functional role (e.g., 'water-in-oil emulsion', 'solvent system: water/ethanol'). Focus on the functional or characterized chemicals.
+3.  **One Row per Substance:** Combine everything found for a substance into a single row: give the overall concentration range found across the document and list all of its use cases in the `Use Case` cell.
+4.  **Order by Importance:** List the substances in descending order of their apparent importance or prominence within the document. Consider factors like:
     *   Frequency of mention.
     *   Whether it's listed as a primary active ingredient or key component.
     *   Detailed discussion of its properties or role.
     *   Presence in example formulations or core experimental sections.
     *   Substances mentioned only briefly or in passing should be lower on the list.
-6.  **Output Format:** Present the results STRICTLY as a Markdown table with the following columns: `Substance Name` | `Concentration Range` | `Use Case`. Do NOT include any introductory text before the table or concluding remarks after it. Just output the table.
-7.  **Exclusions:** Generally exclude very common, non-functional substances like 'water' or 'air' unless they are specifically discussed in a functional role (e.g., 'water-in-oil emulsion', 'solvent system: water/ethanol'). Focus on the functional or characterized chemicals.
-
-Example Table Row:
-| Substance Name      | Concentration Range | Use Case                  |
-|---------------------|---------------------|---------------------------|
-| Sodium Hyaluronate  | 0.1% - 1.5% w/w     | Moisturizer, Active       |
-| Phenoxyethanol      | up to 1%            | Preservative              |
-| Glycerin            | 2% - 5%             | Humectant, Solvent        |
-| Citric Acid         | Not specified       | pH Adjuster               |
-| Titanium Dioxide (TiO2)| 10%              | UV Filter (Sunscreen)     |
-
-Now, analyze the provided PDF content and generate the table. Output ONLY the table, with no additional text, explanations, or whitespace before or after the table.
-"""
 
-def get_detailed_analysis_prompt() -> str:
-    return """
-Analyze the provided content (text excerpts and/or page images from a PDF document) to create a detailed analysis of chemical substances and their specific use cases.
+For the reference example, Glycerin gets a single row: Substance Name "Glycerin", Concentration Range "2% - 10%", Use Case "Humectant, Solvent".
+""")
 
-Follow these instructions carefully:
+_DETAILED_SPECIFIC: str = "\n" + _module("task-detailed", """Task: create a detailed table of chemical substances and their specific use cases. Follow these instructions carefully:
 
 1. **Identify All Use Cases:** For each chemical substance identified in the document, list ALL distinct use cases mentioned, even if they appear in different contexts or sections.
 2. **Match Concentration Ranges:** For each use case, identify the specific concentration range or amount mentioned in that context.
@@ -43,22 +71,59 @@ Follow these instructions carefully:
 4. **Include Context:** If a substance is mentioned with different concentration ranges for different use cases, create separate entries for each combination.
 5. **Be Specific:** If a substance has multiple use cases with different concentration ranges, list each combination separately.
 
-Output Format:
-Present the results as a Markdown table with the following columns:
-`Substance Name` | `Concentration Range` | `Use Case`
-
-Example:
-If a document mentions:
-- Substance A used as a preservative at 0.5-1%
-- Substance A used as a solvent at 2-5%
-- Substance B used as a thickener at 0.1-0.3%
-
-The table should look like:
-| Substance Name | Concentration Range | Use Case     |
-|----------------|---------------------|--------------|
-| Substance A    | 0.5% - 1%          | Preservative |
-| Substance A    | 2% - 5%            | Solvent      |
-| Substance B    | 0.1% - 0.3%        | Thickener    |
-
-Now, analyze the provided PDF content and generate the detailed table. Output ONLY the table, with no additional text or explanations.
-""" 
\ No newline at end of file
+One row per (substance, use case, range) combination. For the reference example, Glycerin gets two rows: ("Glycerin", "2% - 5%", "Humectant") and ("Glycerin", "10%", "Solvent").
+""")
+
+# Closing instructions, one per output format
+_TABLE_TAIL: str = """
+Now, analyze the provided PDF content and generate the table described above. Output ONLY the table, with no additional text, explanations, or whitespace before or after the table.
+"""
+
+_JSON_TAIL: str = """
+Now, analyze the provided PDF content and generate the rows described above. Output ONLY the JSON array, with no additional text or explanations.
+"""
+
+# JSON schema of one result table: an array with one object per row
+_SUBSTANCE_TABLE_SCHEMA: dict = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "substance": {"type": "string"},
+            "range": {"type": "string"},
+            "use_case": {"type": "string"},
+        },
+        "required": ["substance", "range", "use_case"],
+    },
+}
+
+def _compose(output_format: str, task: str, tail: str) -> str:
+    return sys.intern(_COMMON_HEADER + output_format + task + tail)
+
+_INITIAL_PROMPT: str = _compose(_TABLE_FORMAT, _INITIAL_SPECIFIC, _TABLE_TAIL)
+_DETAILED_PROMPT: str = _compose(_TABLE_FORMAT, _DETAILED_SPECIFIC, _TABLE_TAIL)
+_INITIAL_PROMPT_JSON: str = _compose(_JSON_FORMAT, _INITIAL_SPECIFIC, _JSON_TAIL)
+_DETAILED_PROMPT_JSON: str = _compose(_JSON_FORMAT, _DETAILED_SPECIFIC, _JSON_TAIL)
+
+def _prompt_id(prompt: str) -> str:
+    return hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+
+# Stable identifiers of the prompt texts, computed once, e.g. for local cache keys
+INITIAL_PROMPT_ID = _prompt_id(_INITIAL_PROMPT)
+DETAILED_PROMPT_ID = _prompt_id(_DETAILED_PROMPT)
+INITIAL_PROMPT_JSON_ID = _prompt_id(_INITIAL_PROMPT_JSON)
+DETAILED_PROMPT_JSON_ID = _prompt_id(_DETAILED_PROMPT_JSON)
+
+def get_initial_analysis_prompt() -> str:
+    return _INITIAL_PROMPT
+
+def get_detailed_analysis_prompt() -> str:
+    return _DETAILED_PROMPT
+
+def get_initial_analysis_prompt_json() -> Tuple[str, dict]:
+    """Returns the summary prompt for structured output, with the JSON schema of its result."""
+    return _INITIAL_PROMPT_JSON, _SUBSTANCE_TABLE_SCHEMA
+
+def get_detailed_analysis_prompt_json() -> Tuple[str, dict]:
+    """Returns the detailed prompt for structured output, with the JSON schema of its result."""
+    return _DETAILED_PROMPT_JSON, _SUBSTANCE_TABLE_SCHEMA